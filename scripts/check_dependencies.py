@@ -4,12 +4,24 @@ UnixPi Dependency Checker
 Validates all required dependencies and their versions
 """
 
+import functools
+import hashlib
+import json
+import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import distributions
 from pathlib import Path
+from shutil import which
 from typing import Dict, List, Tuple
 
-import pkg_resources
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "unixpi"
+PACKAGES_CACHE = CACHE_DIR / "pkgs.json"
+DEPCHECK_MARKER = CACHE_DIR / "depcheck.ok"
 
 
 def check_python_version() -> bool:
@@ -19,29 +31,70 @@ def check_python_version() -> bool:
     return current_version >= required_version
 
 
-def get_installed_packages() -> Dict[str, str]:
-    """Get all installed Python packages and their versions."""
-    return {pkg.key: pkg.version for pkg in pkg_resources.working_set}
+def _site_packages_key() -> str:
+    """Fingerprint the import path by the mtime of each directory on it."""
+    entries = [sys.executable]
+    for path in sys.path:
+        try:
+            entries.append(f"{path}:{os.stat(path or '.').st_mtime_ns}")
+        except OSError:
+            continue
+    return hashlib.sha256("\n".join(entries).encode()).hexdigest()
 
 
-def read_requirements(file_path: str) -> List[Tuple[str, str]]:
-    """Read requirements from file and return package name and version."""
+@functools.lru_cache(maxsize=1)
+def get_installed_packages() -> Dict[str, str]:
+    """Get all installed Python packages and their versions."""
+    # Installing or removing a distribution touches its site-packages
+    # directory, so an unchanged fingerprint means the cached scan is current
+    key = _site_packages_key()
+    try:
+        with open(PACKAGES_CACHE, "r") as f:
+            cache = json.load(f)
+        if cache.get("key") == key:
+            return cache["packages"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    packages = {
+        canonicalize_name(dist.metadata["Name"]): dist.version
+        for dist in distributions()
+        if dist.metadata["Name"]
+    }
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(PACKAGES_CACHE, "w") as f:
+            json.dump({"key": key, "packages": packages}, f)
+    except OSError:
+        pass
+    return packages
+
+
+@functools.lru_cache(maxsize=None)
+def read_requirements(file_path: str) -> Tuple[Requirement, ...]:
+    """Read requirements from file, skipping those whose markers don't apply.
+
+    pip options (-r, -e, --hash, ...) are not requirements and are skipped,
+    whether on their own line or trailing a requirement.
+    """
     requirements = []
     with open(file_path, "r") as f:
         for line in f:
-            line = line.strip()
-            if line and not line.startswith("#"):
-                if ">=" in line:
-                    name, version = line.split(">=")
-                    requirements.append((name.strip(), version.strip()))
-                else:
-                    requirements.append((line, ""))
-    return requirements
+            line = line.split("#", 1)[0].split(" --", 1)[0].strip(" \t\n\\")
+            if not line or line.startswith("-"):
+                continue
+            try:
+                requirement = Requirement(line)
+            except InvalidRequirement:
+                print(f"! Skipping unparsable requirement: {line}")
+                continue
+            if requirement.marker is None or requirement.marker.evaluate():
+                requirements.append(requirement)
+    return tuple(requirements)
 
 
 def check_system_dependencies() -> List[str]:
     """Check system dependencies."""
-    missing = []
     dependencies = [
         "git",
         "gcc",
@@ -52,13 +105,29 @@ def check_system_dependencies() -> List[str]:
         "libhidapi-dev",
     ]
 
-    for dep in dependencies:
-        try:
-            subprocess.run(["which", dep], check=True, capture_output=True)
-        except subprocess.CalledProcessError:
-            missing.append(dep)
-
-    return missing
+    # Resolve against $PATH in-process rather than spawning `which` per tool;
+    # the lookups are independent stat() walks, so run them concurrently
+    with ThreadPoolExecutor(max_workers=len(dependencies)) as executor:
+        found = executor.map(which, dependencies)
+        return [dep for dep, path in zip(dependencies, found) if path is None]
+
+
+def _depcheck_key(requirements_file: Path) -> str:
+    """Fingerprint every input to a full dependency check on this host."""
+    try:
+        req_mtime = requirements_file.stat().st_mtime_ns
+    except OSError:
+        req_mtime = 0
+    try:
+        apt_output = subprocess.run(
+            ["dpkg", "-l"], check=True, capture_output=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        apt_output = b""
+    apt_hash = hashlib.sha256(apt_output).hexdigest()
+    return hashlib.sha256(
+        f"{sys.version}|{req_mtime}|{apt_hash}|{_site_packages_key()}".encode()
+    ).hexdigest()
 
 
 def main():
@@ -66,6 +135,16 @@ def main():
     print("UnixPi Dependency Checker")
     print("========================")
 
+    # Skip the whole check if it already passed with identical inputs
+    requirements_file = Path(__file__).parent.parent / "requirements.txt"
+    depcheck_key = _depcheck_key(requirements_file)
+    try:
+        if DEPCHECK_MARKER.read_text().strip() == depcheck_key:
+            print("\n✓ All dependencies are satisfied (cached)")
+            sys.exit(0)
+    except OSError:
+        pass
+
     # Check Python version
     print("\nChecking Python version...")
     if check_python_version():
@@ -92,20 +171,21 @@ def main():
     installed_packages = get_installed_packages()
 
     # Check core requirements
-    requirements_file = Path(__file__).parent.parent / "requirements.txt"
     if requirements_file.exists():
         requirements = read_requirements(str(requirements_file))
         missing_packages = []
         outdated_packages = []
 
-        for package, required_version in requirements:
-            if package not in installed_packages:
+        for requirement in requirements:
+            package = requirement.name
+            installed_version = installed_packages.get(canonicalize_name(package))
+            if installed_version is None:
                 missing_packages.append(package)
-            elif required_version and pkg_resources.parse_version(
-                installed_packages[package]
-            ) < pkg_resources.parse_version(required_version):
+            elif not requirement.specifier.contains(
+                installed_version, prereleases=True
+            ):
                 outdated_packages.append(
-                    (package, required_version, installed_packages[package])
+                    (package, str(requirement.specifier), installed_version)
                 )
 
         if missing_packages:
@@ -116,7 +196,7 @@ def main():
         if outdated_packages:
             print("✗ Outdated packages:")
             for package, required, installed in outdated_packages:
-                print(f"  - {package}: installed={installed}, required>={required}")
+                print(f"  - {package}: installed={installed}, required{required}")
 
         if not (missing_packages or outdated_packages):
             print("✓ All required packages are installed and up to date")
@@ -137,6 +217,11 @@ def main():
         sys.exit(1)
     else:
         print("✓ All dependencies are satisfied")
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            DEPCHECK_MARKER.write_text(depcheck_key)
+        except OSError:
+            pass
         sys.exit(0)
 
 
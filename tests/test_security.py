@@ -7,18 +7,41 @@ Comprehensive tests for all security features
 import asyncio
 import json
 import logging
+import struct
 import sys
+import tempfile
+import time
 import unittest
 from datetime import datetime
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import psutil
 import pytest
 from scapy.layers.inet import IP, TCP, UDP
+from scapy.layers.l2 import ARP, CookedLinux, Ether
 from scapy.packet import Packet
 
+from unixpi.security._fastparse import DLT_LINUX_SLL, parse_5tuple, parse_frame
+from unixpi.security.capture_ring import CaptureProcess, PacketRing, _isolate_worker
+from unixpi.security.flow_table import (
+    PROTO_TCP,
+    PROTO_UDP,
+    FlowTable,
+    flow_key,
+    protocol_names,
+)
 from unixpi.security.network_analyzer import NetworkAnalyzer
-from unixpi.security.system_monitor import SystemMonitor
+from unixpi.security.system_monitor import (
+    Baseline,
+    SystemMonitor,
+    _scan_processes,
+)
+
+try:
+    from unixpi.security.packet_mmap import PacketMmap
+except ImportError:  # AF_PACKET is Linux-only
+    PacketMmap = None
 
 # Add project root to path
 sys.path.append(str(Path(__file__).parent.parent))
@@ -83,6 +106,12 @@ class TestNetworkAnalyzer(unittest.TestCase):
             self.analyzer._process_packet(None)
             self.assertTrue(any("error" in msg.lower() for msg in cm.output))
 
+    def test_invalid_packet_logged_once(self):
+        with self.assertLogs(level="ERROR") as cm:
+            self.analyzer._process_packet(None)
+            self.analyzer._process_packet(Ether() / ARP())
+        self.assertEqual(len(cm.output), 1)
+
     def test_invalid_packet_handling(self):
         analyzer = NetworkAnalyzer()
         analyzer._process_packet(
@@ -117,6 +146,284 @@ class TestNetworkAnalyzer(unittest.TestCase):
         assert connection_data["packets"] == 1
         assert connection_data["bytes"] > 0
 
+    def test_report_timestamps_are_iso_strings(self):
+        analyzer = NetworkAnalyzer()
+        analyzer._process_packet(create_mock_packet("TCP"))
+        report = analyzer.generate_report()
+        connection_data = report["connections"]["192.168.1.1:192.168.1.2"]
+        datetime.fromisoformat(connection_data["first_seen"])
+        datetime.fromisoformat(connection_data["last_seen"])
+        json.dumps(report)
+
+    def test_save_report(self):
+        self.analyzer._process_packet(create_mock_packet("TCP"))
+        report_file = "network_report.json"
+        try:
+            self.analyzer.save_report(report_file)
+            with open(report_file) as f:
+                report_data = json.load(f)
+        finally:
+            Path(report_file).unlink()
+        assert report_data["total_connections"] == 1
+        assert "192.168.1.1:192.168.1.2" in report_data["connections"]
+
+    def test_raw_batch_processing(self):
+        analyzer = NetworkAnalyzer()
+        tcp_frame = bytes(
+            Ether() / IP(src="10.0.0.1", dst="10.0.0.2") / TCP(sport=1234, dport=80)
+        )
+        udp_frame = bytes(
+            Ether() / IP(src="10.0.0.1", dst="10.0.0.3") / UDP(sport=1234, dport=53)
+        )
+        arp_frame = bytes(Ether() / ARP())
+        analyzer.process_raw_batch([tcp_frame, tcp_frame, udp_frame, arp_frame])
+        report = analyzer.generate_report()
+        assert report["total_connections"] == 2
+        assert report["connections"]["10.0.0.1:10.0.0.2"]["packets"] == 2
+        assert report["connections"]["10.0.0.1:10.0.0.2"]["bytes"] == 2 * len(tcp_frame)
+        assert set(report["protocols"]) == {"TCP", "UDP", "HTTP", "DNS"}
+        assert report["connections"]["10.0.0.1:10.0.0.2"]["protocols"] == [
+            "TCP",
+            "HTTP",
+        ]
+
+    def test_service_classification(self):
+        analyzer = NetworkAnalyzer()
+        analyzer._process_packet(create_mock_packet("TCP"))
+        analyzer._process_packet(Ether(bytes(Ether() / IP() / TCP(dport=22))))
+        analyzer._process_packet(Ether(bytes(Ether() / IP() / UDP(dport=67))))
+        analyzer._process_packet(Ether(bytes(Ether() / IP() / UDP(dport=80))))
+        assert analyzer.protocols == {"TCP", "UDP", "HTTP", "SSH", "DHCP"}
+
+    def test_report_columns_follow_flow_rows(self):
+        analyzer = NetworkAnalyzer()
+        for dst, now in ((2, 5), (3, 5), (1, 9)):
+            analyzer.flows.update(flow_key(1, dst), PROTO_UDP, 10, now)
+        analyzer.flows.update(flow_key(1, 2), PROTO_TCP, 10, 7)
+        connections = analyzer.generate_report()["connections"]
+        assert list(connections) == [
+            "0.0.0.1:0.0.0.3",
+            "0.0.0.1:0.0.0.1",
+            "0.0.0.1:0.0.0.2",
+        ]
+        assert connections["0.0.0.1:0.0.0.2"]["protocols"] == ["TCP", "UDP"]
+        assert connections["0.0.0.1:0.0.0.2"]["duration"] == pytest.approx(2e-9)
+        assert (
+            connections["0.0.0.1:0.0.0.3"]["first_seen"]
+            == connections["0.0.0.1:0.0.0.2"]["first_seen"]
+        )
+
+    def test_security_findings_flag_bursts(self):
+        analyzer = NetworkAnalyzer()
+        burst, steady = flow_key(0x0A000001, 0x0A000002), flow_key(1, 2)
+        for i in range(1001):
+            analyzer.flows.update(burst, PROTO_TCP, 60, i * 1_000_000)
+            analyzer.flows.update(steady, PROTO_TCP, 60, i * 100_000_000)
+        findings = analyzer.generate_report()["security_findings"]
+        assert [f["connection"] for f in findings] == ["10.0.0.1:10.0.0.2"]
+        assert findings[0]["packets"] == 1001
+
+    def test_http_requests_counted_from_payload(self):
+        analyzer = NetworkAnalyzer()
+        request = bytes(
+            Ether()
+            / IP(src="10.0.0.1", dst="10.0.0.2")
+            / TCP(dport=80, flags="PA", options=[("NOP", None)] * 4)
+            / b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n"
+        )
+        response = bytes(Ether() / IP() / TCP(dport=80) / b"HTTP/1.1 200 OK\r\n")
+        analyzer.process_raw_batch([request, request[:70], response])
+        analyzer._process_packet(Ether(request))
+        report = analyzer.generate_report()
+        assert report["http_requests"] == {"GET": 3}
+        assert [f["description"] for f in report["security_findings"]] == [
+            "Plaintext HTTP traffic detected"
+        ]
+
+    def test_parse_cooked_frame(self):
+        frame = bytes(CookedLinux(proto=0x0800) / IP(src="1.2.3.4", dst="5.6.7.8"))
+        src, dst, proto, dport, length = parse_frame(frame, DLT_LINUX_SLL)
+        assert (src, dst) == (0x01020304, 0x05060708)
+        assert dport == 0
+        assert length == 20
+
+    def test_parse_5tuple_ports(self):
+        tcp = bytes(
+            IP(src="1.2.3.4", dst="5.6.7.8", ihl=6, options=b"\x01" * 4)
+            / TCP(dport=443)
+        )
+        assert parse_5tuple(tcp) == (0x01020304, 0x05060708, 6, 443, len(tcp))
+        fragment = bytes(IP(frag=10) / UDP(dport=53))
+        assert parse_5tuple(fragment)[3] == 0
+
+    def test_dissected_packet_connection_key(self):
+        analyzer = NetworkAnalyzer()
+        wire = bytes(Ether() / IP(src="172.16.0.5", dst="172.16.0.9") / TCP())
+        analyzer._process_packet(Ether(wire))
+        assert analyzer.flows.keys[0] == flow_key(0xAC100005, 0xAC100009)
+        assert "172.16.0.5:172.16.0.9" in analyzer.connections
+        assert analyzer.flows.bytes[0] == len(wire)
+
+    def test_process_batch_skips_non_ip(self):
+        analyzer = NetworkAnalyzer()
+        analyzer.process_batch(
+            [create_mock_packet("TCP"), Ether() / ARP(), create_mock_packet("UDP")]
+        )
+        report = analyzer.generate_report()
+        assert report["total_connections"] == 1
+        assert report["connections"]["192.168.1.1:192.168.1.2"]["packets"] == 2
+
+    @patch("unixpi.security.network_analyzer.PacketMmap", None)
+    @patch("unixpi.security.network_analyzer.pcap", None)
+    @patch("unixpi.security.network_analyzer.sniff")
+    @patch("unixpi.security.network_analyzer.conf")
+    def test_start_capture_batches(self, mock_conf, mock_sniff):
+        analyzer = NetworkAnalyzer()
+        mock_sniff.side_effect = lambda **kwargs: [create_mock_packet("TCP")] * 3
+        analyzer.start_capture(interface="eth0", duration=0.05)
+        mock_conf.L2listen.assert_called_once_with(iface="eth0", filter="ip")
+        mock_conf.L2listen.return_value.close.assert_called_once()
+        assert mock_sniff.call_args.kwargs["count"] == 256
+        assert analyzer.flows.packets[0] == 3 * mock_sniff.call_count
+
+    @patch("unixpi.security.network_analyzer.PacketMmap", None)
+    @patch("unixpi.security.network_analyzer.pcap", None)
+    @patch("unixpi.security.network_analyzer.sniff", return_value=[])
+    @patch("unixpi.security.network_analyzer.conf")
+    def test_start_capture_combines_filters(self, mock_conf, mock_sniff):
+        analyzer = NetworkAnalyzer()
+        analyzer.start_capture(interface="eth0", packet_filter="port 80", duration=0)
+        mock_conf.L2listen.assert_called_once_with(
+            iface="eth0", filter="ip and (port 80)"
+        )
+
+    @patch("unixpi.security.network_analyzer.PacketMmap", None)
+    @patch("unixpi.security.network_analyzer.pcap")
+    def test_start_capture_services_only(self, mock_pcap):
+        analyzer = NetworkAnalyzer()
+        handle = mock_pcap.pcap.return_value
+        handle.datalink.return_value = 1
+        handle.readpkts.return_value = []
+        analyzer.start_capture(interface="eth0", duration=0, services_only=True)
+        packet_filter = handle.setfilter.call_args.args[0]
+        assert packet_filter.startswith("ip and (")
+        assert "tcp and (port 80 or 443" in packet_filter
+
+    @patch("unixpi.security.network_analyzer.PacketMmap", None)
+    @patch("unixpi.security.network_analyzer.pcap")
+    def test_start_capture_pcap(self, mock_pcap):
+        analyzer = NetworkAnalyzer()
+        frame = bytes(Ether() / IP(src="10.0.0.1", dst="10.0.0.2") / UDP())
+        handle = mock_pcap.pcap.return_value
+        handle.datalink.return_value = 1
+        handle.readpkts.return_value = [(0.0, frame), (0.0, frame)]
+        analyzer.start_capture(interface="eth0", duration=0.05)
+        handle.setfilter.assert_called_once_with("ip")
+        assert mock_pcap.pcap.call_args.kwargs["snaplen"] == 96
+        handle.close.assert_called_once()
+        assert analyzer.flows.packets[0] == 2 * handle.readpkts.call_count
+
+    @patch("unixpi.security.network_analyzer.PacketMmap")
+    def test_start_capture_mmap(self, mock_mmap):
+        analyzer = NetworkAnalyzer()
+        ip = bytes(IP(src="10.0.0.1", dst="10.0.0.2") / TCP(dport=443))
+        ring = mock_mmap.return_value
+        ring.dropped = 0
+        ring.packets.side_effect = lambda timeout: iter(
+            [(0x0A000001, 0x0A000002, 6, 443, 14 + len(ip), ip)]
+        )
+        analyzer.start_capture(interface="eth0", duration=0.05)
+        mock_mmap.assert_called_once_with("eth0", None)
+        ring.close.assert_called_once()
+        assert analyzer.protocols == {"TCP", "HTTPS"}
+        assert analyzer.flows.packets[0] == ring.packets.call_count
+
+    @patch("unixpi.security.capture_ring.pcap")
+    @patch("os.sched_getaffinity", create=True, return_value={0, 1, 2, 3})
+    @patch("os.sched_setaffinity", create=True)
+    def test_consumer_avoids_capture_cpu(self, mock_set, mock_get, mock_pcap):
+        capture = CaptureProcess("eth0", "ip", ring_size=64)
+        try:
+            with capture.consumer_affinity():
+                mock_set.assert_called_once_with(0, {0, 1, 2})
+            mock_set.assert_called_with(0, {0, 1, 2, 3})
+        finally:
+            capture.ring.close()
+
+    @unittest.skipIf(PacketMmap is None, "AF_PACKET capture rings require Linux")
+    def test_packet_mmap_bounds_blocks_per_call(self):
+        # A ring the kernel keeps refilling: every block always holds one frame
+        ip = bytes(IP(src="10.0.0.1", dst="10.0.0.2") / UDP(dport=53))
+        block = bytearray(256)
+        struct.pack_into("II", block, 12, 1, 48)
+        # Frame header at 48, link header at 48 + 32, IP header at 48 + 46
+        struct.pack_into("I8xII4xHH", block, 48, 0, 14 + len(ip), 14 + len(ip), 32, 46)
+        block[94 : 94 + len(ip)] = ip
+        ring = PacketMmap.__new__(PacketMmap)
+        ring.block_size, ring.block_count, ring._block = 256, 4, 0
+        ring._view = memoryview(block * 4)
+        with patch.object(PacketMmap, "_ready", return_value=True):
+            packets = list(ring.packets(0, max_blocks=6))
+        assert len(packets) == 6
+        assert packets[0][:5] == (0x0A000001, 0x0A000002, 17, 53, 14 + len(ip))
+        assert ring._block == 2
+
+    @patch("unixpi.security.capture_ring.gc")
+    @patch("os.nice", side_effect=PermissionError)
+    @patch("os.sched_setaffinity", create=True)
+    def test_isolate_capture_worker(self, mock_affinity, mock_nice, mock_gc):
+        _isolate_worker(3)
+        mock_affinity.assert_called_once_with(0, {3})
+        mock_nice.assert_called_once_with(-10)
+        mock_gc.disable.assert_called_once()
+
+    def test_packet_ring_wraps_and_drops(self):
+        ring = PacketRing(size=64)
+        try:
+            assert ring.write_batch([b"a" * 10, b"b" * 20]) == 2
+            assert ring.read_batch(1) == [b"a" * 10]
+            # Does not fit before the end of the ring and would overwrite
+            # the unread frame after wrapping
+            assert ring.write_batch([b"c" * 30]) == 0
+            assert ring.read_batch(10) == [b"b" * 20]
+            assert ring.write_batch([b"c" * 30]) == 1
+            assert ring.read_batch(10) == [b"c" * 30]
+            assert ring.dropped.value == 1
+        finally:
+            ring.close()
+
+    def test_flow_table_growth(self):
+        table = FlowTable()
+        for dst in range(5):
+            table.update(flow_key(1, dst), PROTO_TCP, 100, 1)
+        table.update(flow_key(1, 0), PROTO_TCP, 50, 2)
+        assert len(table) == 5
+        rows = {key: row for key, *row in table.rows()}
+        assert rows[flow_key(1, 0)] == [PROTO_TCP, 2, 150, 1, 2]
+        table.update(flow_key(1, 0), PROTO_UDP, 50, 3)
+        assert protocol_names(table.proto_mask[0]) == ("TCP", "UDP")
+        columns = table.columns()
+        assert columns.keys.tolist() == [flow_key(1, dst) for dst in (1, 2, 3, 4, 0)]
+        assert columns.bytes.tolist() == [100, 100, 100, 100, 200]
+
+    def test_flow_table_evicts_least_recent(self):
+        table = FlowTable(max_flows=2)
+        table.update(flow_key(1, 1), PROTO_TCP, 10, 1)
+        table.update(flow_key(1, 2), PROTO_TCP, 10, 2)
+        table.update(flow_key(1, 1), PROTO_TCP, 10, 3)
+        table.update(flow_key(1, 3), PROTO_TCP, 10, 4)
+        assert len(table) == 2
+        assert {key for key, *_ in table.rows()} == {flow_key(1, 1), flow_key(1, 3)}
+        # The evicted row is reused rather than growing the columns
+        assert len(table.keys) == 2
+
+    def test_flow_table_expires_idle_flows(self):
+        table = FlowTable(ttl=10.0)
+        table.update(flow_key(1, 1), PROTO_TCP, 10, 0)
+        table.update(flow_key(1, 2), PROTO_TCP, 10, 5 * 10**9)
+        table.update(flow_key(1, 3), PROTO_TCP, 10, 12 * 10**9)
+        assert {key for key, *_ in table.rows()} == {flow_key(1, 2), flow_key(1, 3)}
+
 
 @pytest.mark.asyncio
 class TestSystemMonitor(unittest.IsolatedAsyncioTestCase):
@@ -144,6 +451,7 @@ class TestSystemMonitor(unittest.IsolatedAsyncioTestCase):
         self.assertIn("cpu", state)
         self.assertIn("memory", state)
         self.assertIn("processes", state)
+        self.assertLessEqual(state["running_processes"], state["processes"])
 
     @pytest.mark.asyncio
     async def test_anomaly_detection(self):
@@ -193,6 +501,85 @@ class TestSystemMonitor(unittest.IsolatedAsyncioTestCase):
             self.assertEqual(report_data["summary"]["total_security_issues"], 1)
             self.assertEqual(report_data["summary"]["risk_level"], "HIGH")
 
+    async def test_first_cpu_sample_covers_an_interval(self):
+        calls = []
+        with patch(
+            "unixpi.security.system_monitor.psutil.cpu_percent",
+            side_effect=lambda interval: calls.append(time.monotonic()) or 1.0,
+        ):
+            results = await self.monitor.monitor(duration=0.4, interval=0.2)
+        assert len(results["samples"]) == 2
+        assert calls[1] - calls[0] >= 0.2
+
+    def test_scan_processes(self):
+        with tempfile.TemporaryDirectory() as proc:
+            for pid, stat, uid, cmdline in (
+                ("1", b"1 (init) S 0 1 1 0 -1 4194560", 0, b"/sbin/init\0"),
+                ("2", b"2 (cryptd) S 2 0 0 0 -1 69238880", 0, b""),
+                ("42", b"42 (x (miner)) R 1 42 42 0 -1 4194560", 0, b"./xmrig\0"),
+                ("43", b"43 (bash) S 1 43 43 0 -1 4194560", 1000, b"bash\0"),
+                # A miner that has wiped its argv is still flagged
+                ("44", b"44 (miner) S 1 44 44 0 -1 4194560", 1000, b""),
+            ):
+                Path(proc, pid).mkdir()
+                Path(proc, pid, "stat").write_bytes(stat)
+                Path(proc, pid, "status").write_bytes(
+                    b"Name:\tx\nUid:\t%d\t%d\t%d\t%d\n" % ((uid,) * 4)
+                )
+                Path(proc, pid, "cmdline").write_bytes(cmdline)
+            Path(proc, "self").mkdir()
+            with patch("unixpi.security.system_monitor._PROC", proc):
+                total, running, suspicious = _scan_processes()
+        assert (total, running) == (5, 1)
+        assert sorted(suspicious, key=lambda proc: proc["pid"]) == [
+            {"pid": 42, "name": "x (miner)", "uid": 0, "cmdline": "./xmrig"},
+            {"pid": 44, "name": "miner", "uid": 1000, "cmdline": ""},
+        ]
+
+    def test_scan_processes_without_proc(self):
+        procs = []
+        for pid, status, name in (
+            (1, psutil.STATUS_SLEEPING, "launchd"),
+            (7, psutil.STATUS_RUNNING, "xmrig-miner"),
+        ):
+            proc = MagicMock(pid=pid, info={"status": status, "name": name})
+            proc.uids.return_value.real = 501
+            proc.cmdline.return_value = [name, "--donate"]
+            procs.append(proc)
+        with (
+            patch("unixpi.security.system_monitor._PROC", "/nonexistent"),
+            patch(
+                "unixpi.security.system_monitor.psutil.process_iter", return_value=procs
+            ),
+        ):
+            total, running, suspicious = _scan_processes()
+        assert (total, running) == (2, 1)
+        assert suspicious == [
+            {
+                "pid": 7,
+                "name": "xmrig-miner",
+                "uid": 501,
+                "cmdline": "xmrig-miner --donate",
+            }
+        ]
+
+    async def test_security_assessment_reports_once(self):
+        proc = {"pid": 42, "name": "miner", "uid": 1000, "cmdline": ""}
+        state = {"timestamp": "t", "suspicious_processes": [proc]}
+        results = {"security_issues": []}
+        reported = set()
+        await self.monitor._security_assessment(state, results, reported)
+        await self.monitor._security_assessment(state, results, reported)
+        assert len(results["security_issues"]) == 1
+        assert results["security_issues"][0]["severity"] == "MEDIUM"
+
+    def test_baseline_flags_deviation_after_warmup(self):
+        baseline = Baseline(warmup=5)
+        assert not any(baseline.update(100 + i % 3) for i in range(20))
+        assert not baseline.update(105)
+        assert baseline.update(200)
+        assert 100 < baseline.mean < 110
+
     async def test_system_monitor_exception_handling(self):
         monitor = SystemMonitor()
         monitor._get_system_state = lambda: (_ for _ in ()).throw(
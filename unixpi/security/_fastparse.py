@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Fast Packet Parsing Module
+Extracts IPv4 header fields from raw link-layer frames without Scapy
+"""
+
+import struct
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+# libpcap link-layer types we know how to strip
+DLT_EN10MB = 1
+DLT_LINUX_SLL = 113
+
+ETH_P_IP = 0x0800
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+# (ethertype offset, network header offset) per link-layer type
+LINK_LAYOUTS = {
+    DLT_EN10MB: (12, 14),
+    DLT_LINUX_SLL: (14, 16),
+}
+
+_ETHERTYPE = struct.Struct("!H")
+# version/ihl, total length, flags/fragment offset, protocol, addresses
+_IPV4_HEADER = struct.Struct("!BxH2xHxB2xII")
+_PORT = struct.Struct("!H")
+
+_FRAGMENT_OFFSET = 0x1FFF
+_TCP_DATA_OFFSET = 12
+
+# First four payload bytes of an HTTP/1.x request, by method
+_HTTP_METHODS = {
+    b"GET ": "GET",
+    b"POST": "POST",
+    b"PUT ": "PUT",
+    b"HEAD": "HEAD",
+    b"DELE": "DELETE",
+    b"OPTI": "OPTIONS",
+    b"PATC": "PATCH",
+}
+_PORTED_PROTOCOLS = (IPPROTO_TCP, IPPROTO_UDP)
+
+FiveTuple = Tuple[int, int, int, int, int]
+# Packets are parsed from captured bytes or in place from a capture ring
+Buffer = Union[bytes, memoryview]
+
+
+def parse_5tuple(buf: Buffer, offset: int = 0) -> Optional[FiveTuple]:
+    """Parse an IPv4 packet at offset into (src, dst, proto, dport, length)
+
+    Addresses are returned as host-order integers and length is the IP
+    total length. dport is 0 for protocols without ports and for
+    non-initial fragments, and when the capture is too short to hold it.
+    """
+    if len(buf) < offset + _IPV4_HEADER.size:
+        return None
+    ver_ihl, length, frag, proto, src, dst = _IPV4_HEADER.unpack_from(buf, offset)
+    if ver_ihl >> 4 != 4:
+        return None
+    dport = 0
+    l4 = offset + (ver_ihl & 0xF) * 4
+    if (
+        proto in _PORTED_PROTOCOLS
+        and not frag & _FRAGMENT_OFFSET
+        and len(buf) >= l4 + 4
+    ):
+        dport = _PORT.unpack_from(buf, l4 + 2)[0]
+    return src, dst, proto, dport, length
+
+
+def http_method(buf: Buffer, offset: int = 0) -> Optional[str]:
+    """Return the method if the IPv4/TCP packet at offset starts an HTTP request
+
+    Only the first four payload bytes are examined, so this works on
+    captures truncated to a short snaplen.
+    """
+    l4 = offset + (buf[offset] & 0xF) * 4
+    if len(buf) <= l4 + _TCP_DATA_OFFSET:
+        return None
+    payload = l4 + (buf[l4 + _TCP_DATA_OFFSET] >> 4) * 4
+    return _HTTP_METHODS.get(bytes(buf[payload : payload + 4]))
+
+
+def parse_frame(buf: bytes, linktype: int = DLT_EN10MB) -> Optional[FiveTuple]:
+    """Parse a raw link-layer frame into (src, dst, proto, dport, length)"""
+    type_offset, net_offset = LINK_LAYOUTS[linktype]
+    if len(buf) < net_offset:
+        return None
+    if _ETHERTYPE.unpack_from(buf, type_offset)[0] != ETH_P_IP:
+        return None
+    return parse_5tuple(buf, net_offset)
+
+
+def iter_5tuple(
+    frames: Iterable[bytes], linktype: int = DLT_EN10MB
+) -> Iterator[Tuple[int, int, int, int, int, bytes]]:
+    """Yield (src, dst, proto, dport, frame_length, frame) per IPv4 frame
+
+    The frame itself is passed through so callers can inspect payloads of
+    interest without parsing the headers a second time.
+    """
+    type_offset, net_offset = LINK_LAYOUTS[linktype]
+    ethertype = _ETHERTYPE.unpack_from
+    parse = parse_5tuple
+
+    for buf in frames:
+        if len(buf) < net_offset or ethertype(buf, type_offset)[0] != ETH_P_IP:
+            continue
+        fields = parse(buf, net_offset)
+        if fields is None:
+            continue
+        src, dst, proto, dport, length = fields
+        # Count the on-wire size from the IP header so truncated captures
+        # (small snaplen) still report accurate byte totals
+        yield src, dst, proto, dport, net_offset + length, buf
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Capture Ring Module
+Runs packet capture in a separate process feeding a shared memory ring
+"""
+
+import contextlib
+import gc
+import logging
+import multiprocessing
+import os
+import struct
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Iterable, Iterator, List, Optional
+
+try:
+    import pcap
+except ImportError:  # pypcap is optional; CaptureProcess requires it
+    pcap = None
+
+logger = logging.getLogger(__name__)
+
+# Default ring size; must be a power of two
+RING_SIZE = 64 * 1024 * 1024
+
+# Niceness increment for the capture process; negative values raise its
+# priority and only take effect with CAP_SYS_NICE
+CAPTURE_NICE = -10
+
+# Each record is a little-endian length followed by the frame, padded to a
+# 4-byte boundary; a length of _WRAP means "continue at the start"
+_LEN = struct.Struct("<I")
+_WRAP = 0xFFFFFFFF
+
+
+def _record_size(length: int) -> int:
+    return (_LEN.size + length + 3) & ~3
+
+
+class PacketRing:
+    """Single-producer, single-consumer ring of raw frames in shared memory
+
+    head and tail are free-running byte counters held in synchronized
+    multiprocessing Values. The producer publishes head once per batch
+    and the consumer publishes tail once per batch, so the locks behind
+    those Values are taken twice per batch rather than per frame.
+    """
+
+    def __init__(self, size: int = RING_SIZE):
+        """Allocate a ring of size bytes"""
+        if size <= 0 or size & (size - 1):
+            raise ValueError("Ring size must be a power of two")
+        self.size = size
+        self._shm = SharedMemory(create=True, size=size)
+        self._owner_pid = os.getpid()
+        self._head = multiprocessing.Value("Q", 0)
+        self._tail = multiprocessing.Value("Q", 0)
+        self.dropped = multiprocessing.Value("Q", 0)
+
+    @property
+    def _buffer(self) -> memoryview:
+        """The shared memory buffer, which is unset once closed"""
+        buf = self._shm.buf
+        if buf is None:
+            raise ValueError("Packet ring is closed")
+        return buf
+
+    def write_batch(self, frames: Iterable[bytes]) -> int:
+        """Append frames to the ring, dropping any that do not fit"""
+        buf = self._buffer
+        size = self.size
+        mask = size - 1
+        head = self._head.value
+        tail = self._tail.value
+        written = dropped = 0
+
+        for frame in frames:
+            length = len(frame)
+            need = _record_size(length)
+            pos = head & mask
+            pad = size - pos if pos + need > size else 0
+            if head + pad + need - tail > size:
+                # Refresh our view of the consumer before giving up
+                tail = self._tail.value
+                if head + pad + need - tail > size:
+                    dropped += 1
+                    continue
+            if pad:
+                _LEN.pack_into(buf, pos, _WRAP)
+                head += pad
+                pos = 0
+            _LEN.pack_into(buf, pos, length)
+            buf[pos + _LEN.size : pos + _LEN.size + length] = frame
+            head += need
+            written += 1
+
+        self._head.value = head
+        if dropped:
+            with self.dropped.get_lock():
+                self.dropped.value += dropped
+        return written
+
+    def read_batch(self, max_frames: int) -> List[bytes]:
+        """Remove and return up to max_frames frames from the ring"""
+        buf = self._buffer
+        size = self.size
+        mask = size - 1
+        head = self._head.value
+        tail = self._tail.value
+        frames: List[bytes] = []
+
+        while tail != head and len(frames) < max_frames:
+            pos = tail & mask
+            length = _LEN.unpack_from(buf, pos)[0]
+            if length == _WRAP:
+                tail += size - pos
+                continue
+            start = pos + _LEN.size
+            frames.append(bytes(buf[start : start + length]))
+            tail += _record_size(length)
+
+        self._tail.value = tail
+        return frames
+
+    def close(self) -> None:
+        """Release the shared memory, unlinking it in the creating process"""
+        self._shm.close()
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
+
+
+def _isolate_worker(cpu: Optional[int]) -> None:
+    """Pin the capture process to cpu, raise its priority and stop the GC"""
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError as e:
+            logger.warning(f"Could not pin capture process to CPU {cpu}: {e}")
+    try:
+        os.nice(CAPTURE_NICE)
+    except OSError:  # raising priority needs CAP_SYS_NICE; run unboosted
+        pass
+    # The worker allocates no cyclic garbage, so automatic collections only
+    # add pauses on the receive path; collect by hand when idle instead
+    gc.disable()
+
+
+def _capture_worker(
+    ring: PacketRing,
+    interface: str,
+    packet_filter: str,
+    snaplen: int,
+    timeout_ms: int,
+    cpu: Optional[int],
+    linktype: Any,
+    ready: Any,
+    stop: Any,
+) -> None:
+    """Capture process entry point: move frames from libpcap into the ring"""
+    _isolate_worker(cpu)
+    try:
+        try:
+            handle = pcap.pcap(
+                name=interface,
+                snaplen=snaplen,
+                immediate=False,
+                timeout_ms=timeout_ms,
+            )
+            handle.setfilter(packet_filter)
+            linktype.value = handle.datalink()
+        except Exception as e:
+            logger.error(f"Error starting capture process: {e}")
+            return
+        finally:
+            ready.set()
+
+        try:
+            while not stop.is_set():
+                batch = handle.readpkts()
+                if batch:
+                    ring.write_batch(buf for _, buf in batch)
+                else:
+                    gc.collect(0)
+        finally:
+            handle.close()
+    finally:
+        ring.close()
+
+
+class CaptureProcess:
+    """Packet capture running in its own process
+
+    The child only moves raw frames from libpcap into a PacketRing, so
+    dissection and bookkeeping in the parent never stall the receive path.
+    """
+
+    def __init__(
+        self,
+        interface: str,
+        packet_filter: str,
+        ring_size: int = RING_SIZE,
+        snaplen: int = 65535,
+        timeout_ms: int = 100,
+        cpu: Optional[int] = None,
+    ):
+        """Prepare a capture process for interface
+
+        The child is pinned to cpu, or by default to the highest numbered
+        CPU this process may run on. Draining the ring inside
+        consumer_affinity() keeps the consumer off that CPU.
+        """
+        if pcap is None:
+            raise RuntimeError("pypcap is required for process-based capture")
+        if cpu is None and hasattr(os, "sched_getaffinity"):
+            cpus = os.sched_getaffinity(0)
+            if len(cpus) > 1:
+                cpu = max(cpus)
+        self.cpu = cpu
+        self.ring = PacketRing(ring_size)
+        self._linktype = multiprocessing.Value("i", -1)
+        self._ready = multiprocessing.Event()
+        self._stop = multiprocessing.Event()
+        self._process = multiprocessing.Process(
+            target=_capture_worker,
+            args=(
+                self.ring,
+                interface,
+                packet_filter,
+                snaplen,
+                timeout_ms,
+                cpu,
+                self._linktype,
+                self._ready,
+                self._stop,
+            ),
+            daemon=True,
+        )
+
+    def start(self, timeout: Optional[float] = 10.0) -> int:
+        """Start capturing and return the link-layer type of the interface"""
+        self._process.start()
+        self._ready.wait(timeout)
+        linktype = int(self._linktype.value)
+        if linktype < 0:
+            self.stop()
+            raise RuntimeError("Capture process failed to start")
+        return linktype
+
+    @contextlib.contextmanager
+    def consumer_affinity(self) -> Iterator[None]:
+        """Keep the calling thread off the capture CPU within the block"""
+        pinned = self.cpu is not None and hasattr(os, "sched_setaffinity")
+        saved = os.sched_getaffinity(0) if pinned else set()
+        others = saved - {self.cpu}
+        if not others:
+            yield
+            return
+        os.sched_setaffinity(0, others)
+        try:
+            yield
+        finally:
+            os.sched_setaffinity(0, saved)
+
+    def read_batch(self, max_frames: int) -> List[bytes]:
+        """Return up to max_frames captured frames"""
+        return self.ring.read_batch(max_frames)
+
+    def stop(self) -> None:
+        """Stop the capture process and release the ring"""
+        self._stop.set()
+        self._process.join(timeout=5.0)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self.ring.close()
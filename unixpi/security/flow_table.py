@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Flow Table Module
+Columnar connection statistics keyed by packed source/destination addresses
+"""
+
+import functools
+from collections import OrderedDict
+from typing import Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+# Protocols are tracked as bitmasks: bit N is set when PROTOCOL_NAMES[N]
+# has been seen. Transport protocols come first, followed by the
+# application services recognised by destination port.
+PROTOCOL_NAMES = (
+    "TCP",
+    "UDP",
+    "ICMP",
+    "OTHER",
+    "HTTP",
+    "HTTPS",
+    "SSH",
+    "FTP",
+    "DNS",
+    "DHCP",
+)
+(
+    PROTO_TCP,
+    PROTO_UDP,
+    PROTO_ICMP,
+    PROTO_OTHER,
+    PROTO_HTTP,
+    PROTO_HTTPS,
+    PROTO_SSH,
+    PROTO_FTP,
+    PROTO_DNS,
+    PROTO_DHCP,
+) = (1 << bit for bit in range(len(PROTOCOL_NAMES)))
+
+# Default bounds on the table: flows beyond MAX_FLOWS evict the least
+# recently seen one, and flows idle for FLOW_TTL seconds are dropped
+MAX_FLOWS = 65536
+FLOW_TTL = 300.0
+
+
+def flow_key(src: int, dst: int) -> int:
+    """Pack two IPv4 addresses into a single 64-bit flow key"""
+    return (src << 32) | dst
+
+
+@functools.lru_cache(maxsize=None)
+def protocol_names(mask: int) -> Tuple[str, ...]:
+    """Decode a protocol bitmask into protocol names"""
+    return tuple(name for bit, name in enumerate(PROTOCOL_NAMES) if mask & (1 << bit))
+
+
+class FlowColumns(NamedTuple):
+    """NumPy columns of the live flows, least recently seen first"""
+
+    keys: np.ndarray
+    proto_mask: np.ndarray
+    packets: np.ndarray
+    bytes: np.ndarray
+    first_seen: np.ndarray
+    last_seen: np.ndarray
+
+
+class FlowTable:
+    """Structure-of-arrays connection table
+
+    Each tracked connection owns one row in a set of parallel columns; an
+    OrderedDict maps the packed (src, dst) key to its row index in least
+    recently seen order, and rows freed by eviction are reused before the
+    columns grow. The columns are plain lists so per-packet updates stay
+    on Python ints; NumPy arrays are built from them only when a report
+    asks for columns().
+    """
+
+    _COLUMNS = ("keys", "proto_mask", "packets", "bytes", "first_seen", "last_seen")
+    _DTYPES = (np.uint64, np.uint32, np.uint64, np.uint64, np.uint64, np.uint64)
+    __slots__ = ("_index", "_free", "max_flows", "_ttl_ns") + _COLUMNS
+
+    def __init__(self, max_flows: int = MAX_FLOWS, ttl: float = FLOW_TTL):
+        """Initialize an empty table
+
+        Timestamps passed to update() are integer nanoseconds from a
+        monotonic clock; ttl is in seconds.
+        """
+        self._index: "OrderedDict[int, int]" = OrderedDict()
+        self._free: List[int] = []
+        self.max_flows = max_flows
+        self._ttl_ns = int(ttl * 1_000_000_000)
+        self.keys: List[int] = []
+        self.proto_mask: List[int] = []
+        self.packets: List[int] = []
+        self.bytes: List[int] = []
+        self.first_seen: List[int] = []
+        self.last_seen: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _evict(self, now: int) -> None:
+        """Make room for a new flow and drop flows idle past the TTL"""
+        index = self._index
+        cutoff = now - self._ttl_ns
+        while index:
+            key = next(iter(index))
+            idx = index[key]
+            if len(index) < self.max_flows and self.last_seen[idx] >= cutoff:
+                break
+            del index[key]
+            self._free.append(idx)
+
+    def update(self, key: int, proto: int, length: int, now: int) -> None:
+        """Account one packet of length bytes and protocol bit proto to key"""
+        idx = self._index.get(key)
+        if idx is not None:
+            self._index.move_to_end(key)
+            self.proto_mask[idx] |= proto
+            self.packets[idx] += 1
+            self.bytes[idx] += length
+            self.last_seen[idx] = now
+            return
+
+        self._evict(now)
+        if self._free:
+            idx = self._free.pop()
+            self.keys[idx] = key
+            self.proto_mask[idx] = proto
+            self.packets[idx] = 1
+            self.bytes[idx] = length
+            self.first_seen[idx] = now
+            self.last_seen[idx] = now
+        else:
+            idx = len(self.keys)
+            self.keys.append(key)
+            self.proto_mask.append(proto)
+            self.packets.append(1)
+            self.bytes.append(length)
+            self.first_seen.append(now)
+            self.last_seen.append(now)
+        self._index[key] = idx
+
+    def columns(self) -> FlowColumns:
+        """NumPy columns of the tracked flows, least recently seen first"""
+        live = list(self._index.values())
+        return FlowColumns(
+            *(
+                np.fromiter(
+                    map(getattr(self, name).__getitem__, live),
+                    dtype=dtype,
+                    count=len(live),
+                )
+                for name, dtype in zip(self._COLUMNS, self._DTYPES)
+            )
+        )
+
+    def rows(self) -> Iterator[Tuple[int, int, int, int, int, int]]:
+        """Yield (key, proto_mask, packets, bytes, first_seen, last_seen) per flow"""
+        for idx in self._index.values():
+            yield (
+                self.keys[idx],
+                self.proto_mask[idx],
+                self.packets[idx],
+                self.bytes[idx],
+                self.first_seen[idx],
+                self.last_seen[idx],
+            )
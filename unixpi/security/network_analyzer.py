@@ -5,71 +5,586 @@ Analyzes network traffic and generates security reports
 """
 
 import logging
+import socket
+import struct
+import time
+from array import array
 from datetime import datetime
-from typing import Dict, Optional
+from types import MappingProxyType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+)
 
-from scapy.layers.inet import IP, TCP, UDP
+import numpy as np
+import orjson
+from scapy.config import conf
+from scapy.interfaces import get_if_list
+from scapy.layers.inet import ICMP, IP, TCP, UDP
 from scapy.packet import Packet
+from scapy.sendrecv import sniff
+from scapy.supersocket import SuperSocket
+
+try:
+    import pcap
+except ImportError:  # pypcap is optional; fall back to Scapy capture
+    pcap = None
+
+from unixpi.security._fastparse import (
+    DLT_EN10MB,
+    IPPROTO_ICMP,
+    IPPROTO_TCP,
+    IPPROTO_UDP,
+    LINK_LAYOUTS,
+    Buffer,
+    http_method,
+    iter_5tuple,
+    parse_5tuple,
+)
+from unixpi.security.capture_ring import CaptureProcess
+from unixpi.security.flow_table import (
+    FLOW_TTL,
+    MAX_FLOWS,
+    PROTO_DHCP,
+    PROTO_DNS,
+    PROTO_FTP,
+    PROTO_HTTP,
+    PROTO_HTTPS,
+    PROTO_ICMP,
+    PROTO_OTHER,
+    PROTO_SSH,
+    PROTO_TCP,
+    PROTO_UDP,
+    FlowTable,
+    flow_key,
+    protocol_names,
+)
+
+if TYPE_CHECKING:
+    from unixpi.security.packet_mmap import PacketMmap as _PacketMmap
+
+PacketMmap: Optional[Type["_PacketMmap"]]
+try:
+    from unixpi.security.packet_mmap import PacketMmap
+except ImportError:  # AF_PACKET rings are Linux-only
+    PacketMmap = None
 
 logger = logging.getLogger(__name__)
 
+# Protocol bits keyed by IP payload: Scapy layer class or IP protocol number
+_LAYER_PROTOCOLS = {TCP: PROTO_TCP, UDP: PROTO_UDP, ICMP: PROTO_ICMP}
+_RAW_PROTOCOLS = {
+    IPPROTO_TCP: PROTO_TCP,
+    IPPROTO_UDP: PROTO_UDP,
+    IPPROTO_ICMP: PROTO_ICMP,
+}
+_ADDR = struct.Struct("!I")
+
+
+def _port_table(transport: int, services: Dict[int, int]) -> array:
+    """Build a table of protocol bits indexed by destination port"""
+    # One entry per port turns service classification into a single index
+    # with no branching; the service bits do not fit in a byte, hence "H"
+    table = array("H", [transport]) * 65536
+    for port, service in services.items():
+        table[port] = transport | service
+    return table
+
+
+_TCP_PORT_MASK = _port_table(
+    PROTO_TCP, {80: PROTO_HTTP, 443: PROTO_HTTPS, 22: PROTO_SSH, 21: PROTO_FTP}
+)
+_UDP_PORT_MASK = _port_table(PROTO_UDP, {53: PROTO_DNS, 67: PROTO_DHCP, 68: PROTO_DHCP})
+# Port tables keyed by transport bit
+_PORT_MASKS = {PROTO_TCP: _TCP_PORT_MASK, PROTO_UDP: _UDP_PORT_MASK}
+
+# Packets handed to process_batch per sniff() call, and how long to wait for
+# a batch to fill before flushing a partial one
+CAPTURE_BATCH_SIZE = 256
+CAPTURE_BATCH_TIMEOUT = 1.0
+
+# Kernel-side BPF filter so non-IP frames never reach Python
+CAPTURE_FILTER = "ip"
+
+# Narrower kernel-side filter for start_capture(services_only=True): only
+# the protocols and service ports the analyzer classifies
+SERVICE_FILTER = (
+    "(tcp and (port 80 or 443 or 22 or 21)) "
+    "or (udp and (port 53 or 67 or 68)) "
+    "or icmp"
+)
+
+# Bytes copied per packet on the libpcap paths. The analyzer only reads
+# headers, and byte counts come from the IP total length, so a short
+# snapshot saves copying payloads into userspace.
+CAPTURE_SNAPLEN = 96
+
+# How long to wait before polling an empty capture ring again
+RING_POLL_INTERVAL = 0.01
+
+# Connections with more than BURST_PACKETS packets inside BURST_WINDOW
+# seconds are reported as security findings
+BURST_PACKETS = 1000
+BURST_WINDOW = 10.0
+
+# Read-only finding templates, built once at import; reports copy the
+# fields they need rather than rebuilding each dict literal
+_BURST_FINDING = MappingProxyType({"type": "High packet rate", "severity": "MEDIUM"})
+_PLAINTEXT_FINDINGS = (
+    (
+        PROTO_HTTP,
+        MappingProxyType(
+            {
+                "type": "PLAINTEXT",
+                "severity": "HIGH",
+                "description": "Plaintext HTTP traffic detected",
+                "recommendation": "Use HTTPS for all web traffic",
+            }
+        ),
+    ),
+    (
+        PROTO_FTP,
+        MappingProxyType(
+            {
+                "type": "PLAINTEXT",
+                "severity": "HIGH",
+                "description": "Plaintext FTP traffic detected",
+                "recommendation": "Use SFTP or FTPS for file transfers",
+            }
+        ),
+    ),
+)
+
+
+def _connection_name(key: int) -> str:
+    """Format a flow key as "src:dst" """
+    src = socket.inet_ntoa(_ADDR.pack(key >> 32))
+    dst = socket.inet_ntoa(_ADDR.pack(key & 0xFFFFFFFF))
+    return f"{src}:{dst}"
+
+
+def _connection_names(keys: np.ndarray) -> List[str]:
+    """Format an array of flow keys as "src:dst" strings"""
+    # Hosts recur across many flows, so format each distinct address once
+    count = len(keys)
+    addrs, index = np.unique(
+        np.concatenate((keys >> np.uint64(32), keys & np.uint64(0xFFFFFFFF))),
+        return_inverse=True,
+    )
+    text = [socket.inet_ntoa(_ADDR.pack(addr)) for addr in addrs.tolist()]
+    index = index.tolist()
+    return [
+        f"{text[src]}:{text[dst]}" for src, dst in zip(index[:count], index[count:])
+    ]
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def _wire_length(packet: Packet) -> int:
+    """Length of a packet on the wire, without re-serializing it"""
+    # len(packet) rebuilds the whole packet; captured packets already carry
+    # their length from the capture header or their original bytes
+    return packet.wirelen or len(packet.original) or len(packet)
+
 
 class NetworkAnalyzer:
     """Network traffic analyzer for security monitoring"""
 
-    def __init__(self):
+    __slots__ = (
+        "_proto_mask",
+        "flows",
+        "interface",
+        "start_time",
+        "_clock_origin",
+        "_capturing",
+        "_reported_invalid",
+        "http_requests",
+    )
+
+    def __init__(self, max_flows: int = MAX_FLOWS, flow_ttl: float = FLOW_TTL):
         """Initialize the network analyzer"""
-        self.protocols = set()
-        self.connections = {}
+        self._proto_mask = 0
+        self.flows = FlowTable(max_flows=max_flows, ttl=flow_ttl)
         self.interface = "any"
         self.start_time = datetime.now()
+        # Packets are stamped with the monotonic clock; this pair maps those
+        # stamps back to wall-clock time when a report is built
+        self._clock_origin = (time.monotonic_ns(), time.time())
+        self._capturing = False
+        self._reported_invalid = False
+        # HTTP requests seen on port 80, counted by method
+        self.http_requests: Dict[str, int] = {}
+
+    @property
+    def protocols(self) -> Set[str]:
+        """Names of the protocols seen so far"""
+        return set(protocol_names(self._proto_mask))
+
+    def _connection_items(
+        self, timestamp: Callable[[float], Any]
+    ) -> Iterator[Tuple[str, Dict]]:
+        """Yield ("src:dst", statistics) per flow, formatting epoch times"""
+        # Derive every column with whole-array arithmetic on the live rows,
+        # then convert each one to Python objects in a single tolist() call
+        flows = self.flows.columns()
+        count = len(flows.keys)
+        mono, wall = self._clock_origin
+        first_seen = flows.first_seen.astype(np.int64) - mono
+        last_seen = flows.last_seen.astype(np.int64) - mono
+        # Packets in a batch share one timestamp, so format each distinct
+        # stamp once rather than twice per flow
+        stamps, index = np.unique(
+            np.concatenate((first_seen, last_seen)), return_inverse=True
+        )
+        text = [timestamp(stamp) for stamp in (stamps * 1e-9 + wall).tolist()]
+        index = index.tolist()
+        columns = zip(
+            _connection_names(flows.keys),
+            flows.proto_mask.tolist(),
+            flows.packets.tolist(),
+            flows.bytes.tolist(),
+            index[:count],
+            index[count:],
+            ((last_seen - first_seen) * 1e-9).tolist(),
+        )
+        for name, proto_mask, packets, nbytes, first, last, duration in columns:
+            yield name, {
+                "protocols": list(protocol_names(proto_mask)),
+                "packets": packets,
+                "bytes": nbytes,
+                "first_seen": text[first],
+                "last_seen": text[last],
+                "duration": duration,
+            }
+
+    @property
+    def connections(self) -> Dict[str, Dict]:
+        """Per-connection statistics keyed by "src:dst" """
+        return dict(self._connection_items(float))
 
     def _process_packet(self, packet: Optional[Packet]) -> None:
         """Process a single packet and update statistics"""
-        try:
-            if not packet or not packet.haslayer(IP):
-                raise ValueError("Invalid packet or missing IP layer")
-
-            # Extract IP layer
-            ip = packet[IP]
-
-            # Track protocols
-            if packet.haslayer(TCP):
-                self.protocols.add("TCP")
-                proto = "TCP"
-            elif packet.haslayer(UDP):
-                self.protocols.add("UDP")
-                proto = "UDP"
-            else:
-                proto = "OTHER"
-                self.protocols.add(proto)
-
-            # Track connections
-            conn_key = f"{ip.src}:{ip.dst}"
-            if conn_key not in self.connections:
-                self.connections[conn_key] = {
-                    "protocol": proto,
-                    "packets": 0,
-                    "bytes": 0,
-                    "first_seen": datetime.now(),
-                    "last_seen": datetime.now(),
-                }
-
-            self.connections[conn_key]["packets"] += 1
-            self.connections[conn_key]["bytes"] += len(packet)
-            self.connections[conn_key]["last_seen"] = datetime.now()
+        # Walk the layer chain once and classify on the IP payload type
+        # rather than rescanning with haslayer() per protocol
+        ip = packet.getlayer(IP) if packet is not None else None
+        if packet is None or ip is None:
+            # Report the first malformed packet only; at line rate a log
+            # line per packet would cost more than the packets themselves
+            if not self._reported_invalid:
+                self._reported_invalid = True
+                logger.error(
+                    "Error processing packet: invalid packet or missing IP layer "
+                    "(further occurrences are not logged)"
+                )
+            return
+
+        self._account(ip, _wire_length(packet), time.monotonic_ns())
 
+    def _account(self, ip: Packet, length: int, now: int) -> None:
+        """Update protocol and connection statistics for an IP layer"""
+        # Dissected packets keep their wire bytes, so take the 5-tuple from
+        # the raw header as integers instead of via Scapy fields and dotted
+        # strings. Packets built in Python have no wire bytes.
+        fields = parse_5tuple(ip.original)
+        if fields is not None:
+            src, dst, proto_num, dport, _ = fields
+            proto = _RAW_PROTOCOLS.get(proto_num, PROTO_OTHER)
+        else:
+            proto = _LAYER_PROTOCOLS.get(type(ip.payload), PROTO_OTHER)
+            dport = ip.payload.dport if proto & (PROTO_TCP | PROTO_UDP) else 0
+            src = _ADDR.unpack(socket.inet_aton(ip.src))[0]
+            dst = _ADDR.unpack(socket.inet_aton(ip.dst))[0]
+        ports = _PORT_MASKS.get(proto)
+        if ports is not None:
+            proto = ports[dport]
+            if proto & PROTO_HTTP and fields is not None:
+                self._count_http(ip.original, 0)
+
+        # Track protocols
+        self._proto_mask |= proto
+
+        # Track connections
+        self.flows.update(flow_key(src, dst), proto, length, now)
+
+    def _count_http(self, buf: Buffer, offset: int) -> None:
+        """Count the request method if the packet at offset is an HTTP request"""
+        method = http_method(buf, offset)
+        if method is not None:
+            self.http_requests[method] = self.http_requests.get(method, 0) + 1
+
+    def process_batch(self, packets: Iterable[Packet]) -> None:
+        """Process a batch of captured packets"""
+        # Errors are handled per batch so the per-packet path carries no
+        # exception handling of its own
+        try:
+            now = time.monotonic_ns()
+            for packet in packets:
+                ip = packet.getlayer(IP)
+                if ip is None:
+                    continue
+                self._account(ip, _wire_length(packet), now)
         except Exception as e:
-            logger.error(f"Error processing packet: {e}")
+            logger.error(f"Error processing packet batch: {e}")
+
+    def _account_raw(
+        self, packets: Iterable[Tuple[int, int, int, int, int, Buffer]], offset: int
+    ) -> None:
+        """Account (src, dst, proto, dport, length, buf) tuples from a raw path
+
+        offset is where the IP header starts in each buf.
+        """
+        now = time.monotonic_ns()
+        update = self.flows.update
+        mask = self._proto_mask
+        port_masks = _PORT_MASKS.get
+        for src, dst, proto_num, dport, length, buf in packets:
+            proto = _RAW_PROTOCOLS.get(proto_num, PROTO_OTHER)
+            ports = port_masks(proto)
+            if ports is not None:
+                proto = ports[dport]
+                # Peek at the payload only on the HTTP port rather than
+                # dissecting it with Scapy's HTTP layer
+                if proto & PROTO_HTTP:
+                    self._count_http(buf, offset)
+            mask |= proto
+            update(flow_key(src, dst), proto, length, now)
+        self._proto_mask = mask
+
+    def process_raw_batch(
+        self, frames: Iterable[bytes], linktype: int = DLT_EN10MB
+    ) -> None:
+        """Process a batch of raw link-layer frames without Scapy dissection"""
+        self._account_raw(iter_5tuple(frames, linktype), LINK_LAYOUTS[linktype][1])
+
+    def _open_sockets(self, packet_filter: Optional[str]) -> List[SuperSocket]:
+        """Open one listening socket per capture interface"""
+        ifaces = get_if_list() if self.interface == "any" else [self.interface]
+        return [conf.L2listen(iface=iface, filter=packet_filter) for iface in ifaces]
+
+    def _remaining(self, deadline: Optional[float]) -> Optional[float]:
+        """Seconds until the next batch must return, or None to stop"""
+        if not self._capturing:
+            return None
+        if deadline is None:
+            return CAPTURE_BATCH_TIMEOUT
+        remaining = deadline - time.monotonic()
+        return min(CAPTURE_BATCH_TIMEOUT, remaining) if remaining > 0 else None
+
+    def _capture_mmap(self, packet_filter: str, deadline: Optional[float]) -> bool:
+        """Capture through an AF_PACKET ring, parsing frames in place"""
+        # The ring socket only receives IPv4, so the default filter needs
+        # no BPF program (and no libpcap to compile one)
+        if PacketMmap is None:
+            return False
+        try:
+            ring = PacketMmap(
+                self.interface,
+                None if packet_filter == CAPTURE_FILTER else packet_filter,
+            )
+        except (ImportError, OSError) as e:
+            logger.warning(f"AF_PACKET ring unavailable, falling back: {e}")
+            return False
+        try:
+            while True:
+                timeout = self._remaining(deadline)
+                if timeout is None:
+                    break
+                self._account_raw(ring.packets(int(timeout * 1000)), 0)
+        finally:
+            ring.close()
+            if ring.dropped:
+                logger.warning(
+                    f"Capture ring overflowed; {ring.dropped} packets dropped"
+                )
+        return True
+
+    def _capture_pcap(self, packet_filter: str, deadline: Optional[float]) -> bool:
+        """Capture through libpcap, parsing raw frames in batches"""
+        handle = pcap.pcap(
+            name=self.interface,
+            snaplen=CAPTURE_SNAPLEN,
+            immediate=False,
+            timeout_ms=int(CAPTURE_BATCH_TIMEOUT * 1000),
+        )
+        try:
+            handle.setfilter(packet_filter)
+            linktype = handle.datalink()
+            if linktype not in LINK_LAYOUTS:
+                logger.warning(f"Unsupported link type {linktype} for raw capture")
+                return False
+            while self._remaining(deadline) is not None:
+                # readpkts() drains whatever libpcap buffered since the last
+                # call, so each batch costs one dispatch into C
+                batch = handle.readpkts()
+                self.process_raw_batch((buf for _, buf in batch), linktype)
+        finally:
+            handle.close()
+        return True
+
+    def _capture_process(self, packet_filter: str, deadline: Optional[float]) -> None:
+        """Capture in a child process and drain its ring in this one"""
+        capture = CaptureProcess(
+            self.interface,
+            packet_filter,
+            snaplen=CAPTURE_SNAPLEN,
+            timeout_ms=int(CAPTURE_BATCH_TIMEOUT * 1000),
+        )
+        linktype = capture.start()
+        if linktype not in LINK_LAYOUTS:
+            capture.stop()
+            raise RuntimeError(f"Unsupported link type {linktype} for raw capture")
+        try:
+            with capture.consumer_affinity():
+                while self._remaining(deadline) is not None:
+                    frames = capture.read_batch(CAPTURE_BATCH_SIZE)
+                    if frames:
+                        self.process_raw_batch(frames, linktype)
+                    else:
+                        time.sleep(RING_POLL_INTERVAL)
+        finally:
+            capture.stop()
+            if capture.ring.dropped.value:
+                logger.warning(
+                    f"Capture ring overflowed; {capture.ring.dropped.value} "
+                    "packets dropped"
+                )
+
+    def _capture_scapy(self, packet_filter: str, deadline: Optional[float]) -> None:
+        """Capture through Scapy sockets, dissecting packets in batches"""
+        # Keep the sockets open across batches so no packets are lost
+        # between sniff() calls
+        sockets = self._open_sockets(packet_filter)
+        try:
+            while True:
+                timeout = self._remaining(deadline)
+                if timeout is None:
+                    break
+                batch = sniff(
+                    opened_socket=sockets,
+                    count=CAPTURE_BATCH_SIZE,
+                    timeout=timeout,
+                    store=True,
+                )
+                self.process_batch(batch)
+        finally:
+            for sock in sockets:
+                sock.close()
+
+    def start_capture(
+        self,
+        interface: Optional[str] = None,
+        packet_filter: Optional[str] = None,
+        duration: Optional[float] = None,
+        separate_process: bool = False,
+        services_only: bool = False,
+    ) -> None:
+        """Capture packets in batches until stopped or duration elapses
+
+        On Linux, frames are read in place from a memory-mapped AF_PACKET
+        ring, falling back to libpcap and then Scapy where that cannot be
+        opened.
+
+        With separate_process, libpcap runs in a child process that only
+        copies frames into a shared memory ring, so slow analysis here
+        cannot cause kernel buffer overruns. This requires pypcap.
+
+        With services_only, the kernel filter passes only ICMP and the
+        well-known service ports, instead of all IPv4 traffic.
+        """
+        if interface is not None:
+            self.interface = interface
+
+        base_filter = CAPTURE_FILTER
+        if services_only:
+            base_filter = f"{CAPTURE_FILTER} and ({SERVICE_FILTER})"
+        if packet_filter:
+            packet_filter = f"{base_filter} and ({packet_filter})"
+        else:
+            packet_filter = base_filter
+
+        deadline = None if duration is None else time.monotonic() + duration
+        self._capturing = True
+        try:
+            # Header-only parsing is much cheaper per packet than Scapy
+            # dissection, so prefer the raw paths whenever they are available
+            # and the link type is one the raw parser understands
+            if separate_process:
+                self._capture_process(packet_filter, deadline)
+            elif not (
+                self._capture_mmap(packet_filter, deadline)
+                or (pcap is not None and self._capture_pcap(packet_filter, deadline))
+            ):
+                self._capture_scapy(packet_filter, deadline)
+        finally:
+            self._capturing = False
+
+    def stop_capture(self) -> None:
+        """Stop a running capture after the current batch"""
+        self._capturing = False
+
+    def _add_security_findings(self, report: Dict) -> None:
+        """Add findings for plaintext protocols and traffic bursts to report"""
+        findings = [
+            dict(finding)
+            for proto, finding in _PLAINTEXT_FINDINGS
+            if self._proto_mask & proto
+        ]
+
+        # Select candidate rows with one vectorised mask over the columns;
+        # only the handful that match are converted to Python objects
+        flows = self.flows.columns()
+        duration = flows.last_seen - flows.first_seen
+        burst = (flows.packets > BURST_PACKETS) & (
+            duration < int(BURST_WINDOW * 1_000_000_000)
+        )
+        findings.extend(
+            {
+                **_BURST_FINDING,
+                "connection": _connection_name(key),
+                "packets": packets,
+                "duration": (last_seen - first_seen) * 1e-9,
+            }
+            for key, packets, first_seen, last_seen in zip(
+                flows.keys[burst].tolist(),
+                flows.packets[burst].tolist(),
+                flows.first_seen[burst].tolist(),
+                flows.last_seen[burst].tolist(),
+            )
+        )
+        report["security_findings"] = findings
 
     def generate_report(self) -> Dict:
         """Generate a report of network activity"""
-        return {
+        # Timestamps are stored as monotonic nanoseconds on the hot path and
+        # only converted to ISO strings here, in the same pass that builds
+        # each connection entry
+        connections = dict(self._connection_items(_isoformat))
+        protocols = self.protocols
+        report = {
             "timestamp": datetime.now().isoformat(),
             "start_time": self.start_time.isoformat(),
             "interface": self.interface,
-            "protocols": list(self.protocols),
-            "connections": self.connections,
-            "total_connections": len(self.connections),
-            "unique_protocols": len(self.protocols),
+            "protocols": sorted(protocols),
+            "connections": connections,
+            "total_connections": len(connections),
+            "unique_protocols": len(protocols),
+            "http_requests": dict(self.http_requests),
         }
+        self._add_security_findings(report)
+        return report
+
+    def save_report(self, output_file: str) -> None:
+        """Write the network activity report to a JSON file"""
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(self.generate_report(), option=orjson.OPT_INDENT_2))
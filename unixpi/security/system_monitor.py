@@ -5,42 +5,183 @@ Monitors system state and detects security anomalies
 """
 
 import asyncio
-import json
 import logging
+import math
 import os
 import platform
-import psutil
+import re
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set, Tuple
+
+import orjson
+import psutil
 
 logger = logging.getLogger(__name__)
 
+_PROC = "/proc"
+
+# Process names that warrant a security issue
+_SUSPICIOUS_NAMES = re.compile(rb"crypto|miner|botnet", re.IGNORECASE)
+
+# PF_KTHREAD from <linux/sched.h>, set in the flags field of kernel threads
+_PF_KTHREAD = 0x00200000
+
+
+def _read_proc(pid: str, name: str) -> bytes:
+    """Read /proc/<pid>/<name>"""
+    with open(f"{_PROC}/{pid}/{name}", "rb") as f:
+        return f.read()
+
+
+def _process_owner(status: bytes) -> Optional[int]:
+    """Real UID from the contents of /proc/<pid>/status"""
+    for line in status.splitlines():
+        if line.startswith(b"Uid:"):
+            return int(line.split()[1])
+    return None
+
+
+def _scan_psutil() -> Tuple[int, int, List[Dict]]:
+    """_scan_processes() through psutil, for platforms without /proc"""
+    total = running = 0
+    suspicious = []
+    for proc in psutil.process_iter(["status", "name"]):
+        total += 1
+        if proc.info["status"] == psutil.STATUS_RUNNING:
+            running += 1
+        name = proc.info["name"] or ""
+        if _SUSPICIOUS_NAMES.search(name.encode()) is None:
+            continue
+        try:
+            uid = proc.uids().real
+            cmdline = " ".join(proc.cmdline())
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        suspicious.append(
+            {"pid": proc.pid, "name": name, "uid": uid, "cmdline": cmdline}
+        )
+    return total, running, suspicious
+
+
+def _scan_processes() -> Tuple[int, int, List[Dict]]:
+    """Count total and running processes and find suspicious ones
+
+    Makes one pass over /proc. The command name comes from the same stat
+    read as the state, so only processes whose name matches
+    _SUSPICIOUS_NAMES cost the extra status and cmdline reads.
+    """
+    if not os.path.isdir(_PROC):
+        return _scan_psutil()
+    total = running = 0
+    suspicious = []
+    for entry in os.scandir(_PROC):
+        pid = entry.name
+        if not pid.isdigit():
+            continue
+        try:
+            data = _read_proc(pid, "stat")
+        except OSError:  # exited since the directory was listed
+            continue
+        total += 1
+        # The state follows the parenthesised command name, which may itself
+        # contain spaces or parentheses
+        end = data.rindex(b")")
+        if data[end + 2] == ord("R"):
+            running += 1
+        name = data[data.index(b"(") + 1 : end]
+        if _SUSPICIOUS_NAMES.search(name) is None:
+            continue
+        # Names such as cryptd belong to kernel threads, not to a miner. An
+        # empty command line is no sign of one, since a process can clear
+        # its own argv
+        if int(data[end + 2 :].split()[6]) & _PF_KTHREAD:
+            continue
+        try:
+            cmdline = _read_proc(pid, "cmdline").replace(b"\0", b" ").strip()
+            uid = _process_owner(_read_proc(pid, "status"))
+        except OSError:
+            continue
+        suspicious.append(
+            {
+                "pid": int(pid),
+                "name": name.decode(errors="replace"),
+                "uid": uid,
+                "cmdline": cmdline.decode(errors="replace"),
+            }
+        )
+    return total, running, suspicious
+
+
+class Baseline:
+    """Exponentially weighted running mean and variance of one metric
+
+    Each update is O(1) and the baseline follows slow drift, so long runs
+    compare samples against recent behaviour rather than the first sample.
+    """
+
+    __slots__ = ("alpha", "warmup", "tolerance", "mean", "var", "count")
+
+    def __init__(self, alpha: float = 0.05, warmup: int = 10, tolerance: float = 0.1):
+        """Initialize an empty baseline with smoothing factor alpha
+
+        Deviations smaller than tolerance times the mean are never flagged,
+        so a metric that has been constant does not alarm on the first
+        small change.
+        """
+        self.alpha = alpha
+        self.warmup = warmup
+        self.tolerance = tolerance
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+
+    def update(self, value: float, sigmas: float = 3.0) -> bool:
+        """Fold value into the baseline; True if it deviated by > sigmas"""
+        self.count += 1
+        if self.count == 1:
+            self.mean = float(value)
+            return False
+        diff = value - self.mean
+        deviated = self.count > self.warmup and abs(diff) > max(
+            sigmas * math.sqrt(self.var), self.tolerance * abs(self.mean)
+        )
+        incr = self.alpha * diff
+        self.mean += incr
+        self.var = (1 - self.alpha) * (self.var + diff * incr)
+        return deviated
+
 
 class SystemMonitor:
     """System state and security monitor"""
 
     def __init__(self):
         """Initialize the system monitor"""
-        self.baseline = None
+        self.baseline = {"processes": Baseline()}
         self.thresholds = {
             "cpu": 80.0,  # CPU usage threshold (%)
             "memory": 85.0,  # Memory usage threshold (%)
             "disk": 90.0,  # Disk usage threshold (%)
             "network": 1000000,  # Network traffic threshold (bytes/s)
         }
+        # Static for the lifetime of the process, so read once rather than
+        # re-parsing /proc on every sample
+        self._cpu_count = psutil.cpu_count()
+        self._boot_time = datetime.fromtimestamp(psutil.boot_time()).isoformat()
 
-    async def _get_system_state(self) -> Dict:
-        """Get current system state"""
+    def _sample_system_state(self) -> Dict:
+        """Sample the current system state, blocking the calling thread"""
         try:
-            cpu_percent = psutil.cpu_percent(interval=0.1)
+            # Non-blocking: usage since the previous call, primed in monitor()
+            cpu_percent = psutil.cpu_percent(interval=None)
             memory = psutil.virtual_memory()
             disk = psutil.disk_usage("/")
             net_io = psutil.net_io_counters()
+            processes, running, suspicious = _scan_processes()
 
             return {
                 "timestamp": datetime.now().isoformat(),
-                "cpu": {"percent": cpu_percent, "count": psutil.cpu_count()},
+                "cpu": {"percent": cpu_percent, "count": self._cpu_count},
                 "memory": {
                     "total": memory.total,
                     "available": memory.available,
@@ -58,34 +199,51 @@ class SystemMonitor:
                     "packets_sent": net_io.packets_sent,
                     "packets_recv": net_io.packets_recv,
                 },
-                "processes": len(psutil.pids()),
-                "boot_time": datetime.fromtimestamp(psutil.boot_time()).isoformat(),
+                "processes": processes,
+                "running_processes": running,
+                "suspicious_processes": suspicious,
+                "boot_time": self._boot_time,
             }
         except Exception as e:
             logger.error(f"Error getting system state: {e}")
             return {}
 
+    async def _get_system_state(self) -> Dict:
+        """Get current system state"""
+        # psutil reads /proc synchronously, so keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sample_system_state)
+
     async def _check_anomalies(self, state: Dict, results: Dict) -> None:
         """Check for system anomalies"""
         if not state:
             return
 
-        logger.debug(f"Checking for anomalies in state: {state}")
-        logger.debug(f"Current thresholds: {self.thresholds}")
-        logger.debug(
-            f"CPU usage: {state['cpu']['percent']}% | Threshold: {self.thresholds['cpu']}%"
-        )
-        logger.debug(
-            f"Memory usage: {state['memory']['percent']}% | Threshold: {self.thresholds['memory']}%"
-        )
-        logger.debug(f"Memory total: {state['memory']['total']} bytes")
-        logger.debug(f"Memory available: {state['memory']['available']} bytes")
-        logger.debug(
-            f"Disk usage: {state['disk']['percent']}% | Threshold: {self.thresholds['disk']}%"
-        )
-        logger.debug(
-            f"Network traffic: {state['network']['bytes_sent']} bytes/s | Threshold: {self.thresholds['network']} bytes/s"
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            cpu, memory, disk = state["cpu"], state["memory"], state["disk"]
+            thresholds = self.thresholds
+            logger.debug("Checking for anomalies in state: %s", state)
+            logger.debug("Current thresholds: %s", thresholds)
+            logger.debug(
+                "CPU usage: %s%% | Threshold: %s%%", cpu["percent"], thresholds["cpu"]
+            )
+            logger.debug(
+                "Memory usage: %s%% | Threshold: %s%%",
+                memory["percent"],
+                thresholds["memory"],
+            )
+            logger.debug("Memory total: %s bytes", memory["total"])
+            logger.debug("Memory available: %s bytes", memory["available"])
+            logger.debug(
+                "Disk usage: %s%% | Threshold: %s%%",
+                disk["percent"],
+                thresholds["disk"],
+            )
+            logger.debug(
+                "Network traffic: %s bytes/s | Threshold: %s bytes/s",
+                state["network"]["bytes_sent"],
+                thresholds["network"],
+            )
 
         # CPU anomalies
         if state["cpu"]["percent"] > self.thresholds["cpu"]:
@@ -120,6 +278,50 @@ class SystemMonitor:
                 }
             )
 
+        # Process count anomalies, against the running baseline
+        processes = self.baseline["processes"]
+        mean = processes.mean
+        if processes.update(state["processes"]):
+            results["anomalies"].append(
+                {
+                    "type": "Processes",
+                    "message": (
+                        f"Unusual process count: {state['processes']} "
+                        f"(baseline {mean:.0f})"
+                    ),
+                    "severity": "MEDIUM",
+                    "timestamp": state["timestamp"],
+                }
+            )
+
+    async def _security_assessment(
+        self, state: Dict, results: Dict, reported: Set[int]
+    ) -> None:
+        """Record suspicious processes not already reported in this run"""
+        for proc in state.get("suspicious_processes", ()):
+            if proc["pid"] in reported:
+                continue
+            reported.add(proc["pid"])
+            results["security_issues"].append(
+                {
+                    "type": "Process",
+                    "message": (
+                        f"Suspicious process: {proc['name']} (pid {proc['pid']})"
+                    ),
+                    "severity": "HIGH" if proc["uid"] == 0 else "MEDIUM",
+                    "timestamp": state["timestamp"],
+                }
+            )
+
+    async def _record_sample(
+        self, state: Dict, results: Dict, reported: Set[int]
+    ) -> None:
+        """Store a sample and check it for anomalies and security issues"""
+        if state:
+            results["samples"].append(state)
+            await self._check_anomalies(state, results)
+            await self._security_assessment(state, results, reported)
+
     async def monitor(self, duration: int = 60, interval: float = 1.0) -> Dict:
         """Monitor system for the specified duration"""
         start_time = datetime.now()
@@ -132,14 +334,22 @@ class SystemMonitor:
             "security_issues": [],
         }
 
-        # Collect samples
+        # Prime the CPU counters; cpu_percent then reports usage since the
+        # previous call, so the first sample must wait a full interval
+        psutil.cpu_percent(interval=None)
+
+        # Take each sample at the end of an interval and let it run while
+        # the next interval sleeps, so sampling time does not stretch it
         iterations = int(duration / interval)
+        reported: Set[int] = set()
+        pending: Optional["asyncio.Future[Dict]"] = None
         for _ in range(iterations):
-            state = await self._get_system_state()
-            if state:
-                results["samples"].append(state)
-                await self._check_anomalies(state, results)
             await asyncio.sleep(interval)
+            if pending is not None:
+                await self._record_sample(await pending, results, reported)
+            pending = asyncio.ensure_future(self._get_system_state())
+        if pending is not None:
+            await self._record_sample(await pending, results, reported)
 
         results["end_time"] = datetime.now().isoformat()
         return results
@@ -169,8 +379,8 @@ class SystemMonitor:
             }
 
             # Write report to file
-            with open(output_file, "w") as f:
-                json.dump(results, f, indent=2)
+            with open(output_file, "wb") as f:
+                f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
         except Exception as e:
             logger.error(f"Error generating report: {e}")